@@ -1,54 +1,39 @@
-import requests  # Library for making HTTP requests
 import gspread  # Library for interacting with Google Sheets
-from oauth2client.service_account import ServiceAccountCredentials  # For Google Sheets API authentication
-import json  # Library for handling JSON data
-from datetime import datetime, timedelta  # For date manipulation
-import currencyapicom  # For fetching currency exchange rates
-
-# Load credentials from the JSON file for Google Sheets API access
-scope = [
-    'https://spreadsheets.google.com/feeds',  # Scope for Google Sheets
-    'https://www.googleapis.com/auth/drive'    # Scope for Google Drive
-]
-credentials = ServiceAccountCredentials.from_json_keyfile_name('<serverkey json file>', scope)
-
-# Authenticate and create a client to interact with Google Sheets API
-gc = gspread.authorize(credentials)
-
-# Open the specified spreadsheet by its URL
-sheet = gc.open_by_url('<yourGoogleSheet>')
-
-# Select the worksheet by name
-worksheet = sheet.worksheet('CurrentMargin')  # Change 'CurrentMargin' to your actual sheet name if needed
-
-class HubSpotAPI:
-    def __init__(self):
-        # Initialize API access details for HubSpot
-        self.access_token = "<your API Token>"  # HubSpot API token
-        self.url = "https://api.hubspot.com/crm/v3/objects/deals/search"  # URL for HubSpot deals API
-        self.headers = {
-            "Authorization": f"Bearer {self.access_token}",  # Set the authorization header
-            "Content-Type": "application/json"  # Specify content type as JSON
-        }
-        
-    def find_deals(self, start_date, end_date, deal_stage, page):
+from datetime import datetime  # For date manipulation
+from concurrent.futures import ThreadPoolExecutor  # For running HubSpot requests concurrently
+from HubSpotCommon import HubSpotClient, get_nz_to_aud_rate, get_worksheet, retry_on_rate_limit  # Shared HubSpot and Google Sheets helpers
+
+# Month and day bounds of each calendar quarter
+QUARTER_BOUNDS = {
+    1: ("01-01", "03-31"),
+    2: ("04-01", "06-30"),
+    3: ("07-01", "09-30"),
+    4: ("10-01", "12-31")
+}
+
+class HubSpotAPI(HubSpotClient):
+    amount_property = "amount"  # Deal property holding the deal amount
+
+    def find_deals(self, start_date, end_date, deal_stage, after=None):
         """
-        Fetch deals from HubSpot based on date range and deal stages.
+        Fetch one page of deals from HubSpot based on date range and deal stages.
 
         Args:
             start_date (str): The start date for the deals.
             end_date (str): The end date for the deals.
             deal_stage (list): List of deal stages to filter.
-            page (str): Pagination type ("limit" or "after").
+            after (str): Paging cursor returned by the previous page, or None for the first page.
 
         Returns:
-            list: A list of deals retrieved from HubSpot.
+            tuple: A list of deals retrieved from HubSpot and the cursor for the next page (None if this is the last page).
+
+        Raises:
+            HubSpotError: If the page cannot be fetched. A failed page aborts the run instead of ending pagination early.
         """
         # Prepare the request data for fetching deals
         data = {
             "limit": 100,  # Limit the number of results to 100
-            page: 100,  # Use the provided pagination type
-            "properties": ["net_revenue", "amount", "dealstage", "deal_currency_code"],  # Properties to retrieve
+            "properties": ["net_revenue", "amount", "deal_currency_code"],  # Only the properties used in the report
             "filterGroups": [
                 {
                     "filters": [
@@ -58,86 +43,35 @@ class HubSpotAPI:
                 }
             ]
         }
+        return self.search(data, after)  # Fetch the page of deals
 
-        # Make a POST request to the HubSpot API to fetch deals
-        response = requests.post(self.url, headers=self.headers, json=data)
-        if response.status_code == 200:
-            # If successful, return the list of deals
-            return response.json().get('results', [])
-        else:
-            # Print error details if the request fails
-            print("Request failed:", response.status_code, response.text)
-            return []
-
-    def extract_data(self, deals, rate):
+    def fetch_period_deals(self, start_date, end_date, deal_stage):
         """
-        Extract and calculate financial metrics from the fetched deals.
+        Fetch all deals for a date range and set of deal stages.
 
         Args:
-            deals (list): The list of deals retrieved from HubSpot.
-            rate (float): The exchange rate from NZD to AUD.
+            start_date (str): The start date for the deals.
+            end_date (str): The end date for the deals.
+            deal_stage (list): List of deal stages to filter.
 
         Returns:
-            tuple: Calculated metrics including margin and total deal count.
-        """
-        # Initialize variables for aggregating data
-        idcal = []  # List to store deal IDs
-        num_amounts = 0  # Total amounts counter
-        num_net_revenue = 0  # Total net revenue counter
-
-        # Loop through each deal to extract relevant information
-        for deal in deals:
-            amount = deal['properties'].get('amount')  # Get the deal amount
-            id = deal['properties'].get('hs_object_id')  # Get the deal ID
-            net_revenue = deal['properties'].get('net_revenue')  # Get the net revenue
-            currency = deal['properties'].get('deal_currency_code')  # Get the currency type
-
-            idcal.append(id)  # Store the deal ID for reference
-
-            # If the currency is NZD, convert the net revenue to AUD
-            if currency == "NZD":
-                if rate is not None:  # Ensure the exchange rate was successfully fetched
-                    net_revenue_aud = float(net_revenue) / rate  # Convert net revenue to AUD
-                    net_revenue = net_revenue_aud  # Update net revenue to AUD
-
-            # Aggregate the total amounts and net revenue
-            num_amounts += float(amount)  # Aggregate the deal amounts
-            if net_revenue:
-                num_net_revenue += float(net_revenue)  # Aggregate net revenue if available
-            else:
-                num_net_revenue += float(amount)  # Use the amount if net revenue is not available
-
-            # Calculate margin based on aggregated data
-            margin = ((num_net_revenue / num_amounts) * 100)  # Calculate profit margin
-
-        return margin, len(idcal)  # Return the calculated margin and the number of deals
-
-    def get_nz_to_aud_rate(self):
+            list: A list of deals retrieved from HubSpot.
         """
-        Fetch the latest NZD to AUD exchange rate.
+        deals = []
+        for page in self.iter_deal_pages(start_date, end_date, deal_stage):
+            deals += page  # Combine the pages
+        return deals
 
-        Returns:
-            float: The conversion rate from NZD to AUD, or None if an error occurs.
-        """
-        client = currencyapicom.Client('<currency API>')  # Initialize the currency client
-        try:
-            # Fetch the latest exchange rate for NZD to AUD
-            result = client.latest('AUD', currencies=['NZD'])
-            amount = result['data']['NZD']['value']  # Get the exchange rate value
-            amount = float(amount)  # Convert the rate to a float
-
-            return amount  # Return the exchange rate
-        except Exception as e:
-            # Print error message if fetching the exchange rate fails
-            print(f"Error fetching exchange rate: {e}")
-            return None
-
-    def alltime(self, deal_stage, quarterstart, quarterend, financialstart, financialend, rate):
+    def alltime(self, sales, renewels, quarterstart, quarterend, financialstart, financialend, rate):
         """
         Fetch and compute margin and total deal counts for specified quarters and financial years.
 
+        Sales and renewal deals are fetched separately and the figures for all deals
+        are derived from their sums, so every deal is only fetched once per period.
+
         Args:
-            deal_stage (list): List of deal stages to filter.
+            sales (list): List of sales deal stages.
+            renewels (list): List of renewal deal stages.
             quarterstart (str): Start date of the current quarter.
             quarterend (str): End date of the current quarter.
             financialstart (str): Start date of the financial year.
@@ -145,7 +79,7 @@ class HubSpotAPI:
             rate (float): The exchange rate from NZD to AUD.
 
         Returns:
-            tuple: Lists of margins and total deal counts for each period.
+            tuple: Lists of margins and total deal counts for each period, ordered all, sales, renewals.
         """
         # Initialize lists to store margins and totals
         margins = []
@@ -157,16 +91,25 @@ class HubSpotAPI:
             ("Financial Year", financialstart, financialend)
         ]
 
-        # Loop through each quarter and deal stage category to fetch deals
-        for quarter, start, end in quarters:
-            for stage_category in deal_stage:
-                deals = self.find_deals(start, end, stage_category, "limit")  # Fetch deals with "limit"
-                deals_after = self.find_deals(start, end, stage_category, "after")  # Fetch deals with "after" pagination
-                all_deals = deals + deals_after  # Combine both results
+        # Build every quarter and deal stage category combination to fetch deals for
+        queries = [(quarter, start, end, stage_category) for quarter, start, end in quarters for stage_category in (sales, renewels)]
+
+        # Fetch the deals for all combinations concurrently, results keep the order of the queries
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            futures = [executor.submit(self.fetch_period_deals, start, end, stage_category) for quarter, start, end, stage_category in queries]
+            results = [future.result() for future in futures]
 
-                if all_deals:  # Check if any deals were retrieved
-                    # Extract and compute data
-                    margin, total = self.extract_data(all_deals, rate)
+        # Aggregate the deals of each combination into amount, net revenue and count sums
+        sums = [self.aggregate_deals(deals, rate) for deals in results]
+
+        # Loop through each quarter to compute the metrics for all, sales and renewal deals
+        for index, (quarter, start, end) in enumerate(quarters):
+            sales_sums, renewel_sums = sums[2 * index], sums[2 * index + 1]
+            all_sums = tuple(sale + renewel for sale, renewel in zip(sales_sums, renewel_sums))  # All deals are sales plus renewals
+
+            for num_amounts, num_net_revenue, total in (all_sums, sales_sums, renewel_sums):
+                if total:  # Check if any deals were retrieved
+                    margin = ((num_net_revenue / num_amounts) * 100) if num_amounts else 0.0  # Calculate profit margin
                     margins.append(margin)  # Append margin to list
                     totals.append(total)  # Append total deal count to list
                 else:
@@ -184,16 +127,9 @@ class HubSpotAPI:
             tuple: Start and end dates of the current quarter in YYYY-MM-DD format.
         """
         today = datetime.today()  # Get today's date
-
-        # Determine the start date of the current quarter
-        quarter_start = (today.month - 1) // 3 * 3 + 1  # Calculate quarter start month
-        start_date = datetime(today.year, quarter_start, 1)  # Start date of the quarter
-
-        # Calculate the last day of the current quarter
-        next_quarter_start = datetime(today.year, quarter_start + 3, 1) if quarter_start < 10 else datetime(today.year + 1, 1, 1)
-        end_date = next_quarter_start - timedelta(days=1)  # Last day of the current quarter
-
-        return start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')  # Return formatted dates
+        quarter = (today.month - 1) // 3 + 1  # Calendar quarter of today's date
+        start, end = QUARTER_BOUNDS[quarter]  # Month and day bounds of the quarter
+        return f"{today.year}-{start}", f"{today.year}-{end}"  # Return formatted dates
 
     def get_current_financial_year_dates(self):
         """
@@ -203,21 +139,20 @@ class HubSpotAPI:
             tuple: Start and end dates of the current financial year in YYYY-MM-DD format.
         """
         today = datetime.today()  # Get today's date
-        start_date = datetime(today.year, 7, 1) if today.month >= 7 else datetime(today.year - 1, 7, 1)  # Determine start date
-        end_date = datetime(today.year + 1, 6, 30) if today.month >= 7 else datetime(today.year, 6, 30)  # Determine end date
-        return start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')  # Return formatted dates
+        start_year = today.year if today.month >= 7 else today.year - 1  # Financial year starts on 1 July
+        return f"{start_year}-07-01", f"{start_year + 1}-06-30"  # Return formatted dates
 
-def main():
+def write_report(rate):
     """
-    Main function to execute the report generation process.
-    Fetches data from HubSpot, processes it, and writes results to Google Sheets.
+    Fetch data from HubSpot, process it, and write the results to Google Sheets.
+
+    Args:
+        rate (float): The exchange rate from NZD to AUD, or None if it could not be fetched.
     """
-    all = ["123633772", "848f19bf-930a-4f0f-bbc5-8d4b69d2cc3a"]  # List of all deal stages
     sales = ["123633772"]  # List of sales deal stages
     renewels = ["848f19bf-930a-4f0f-bbc5-8d4b69d2cc3a"]  # List of renewal deal stages
 
     hubspot_api = HubSpotAPI()  # Initialize the HubSpot API client
-    rate = hubspot_api.get_nz_to_aud_rate()  # Fetch the NZD to AUD conversion rate
 
     # Get the current quarter and financial year dates
     current_quarter_start, current_quarter_end = hubspot_api.get_current_quarter_dates()
@@ -225,27 +160,39 @@ def main():
 
     row = 2  # Starting row for writing data in the worksheet
     col = 1  # Starting column for writing data in the worksheet
-    values_entered = 0  # Counter for values entered
+    rows_per_col = 3  # Number of values written down each column before moving right
 
     # Fetch margins and totals for the specified deal stages and periods
-    margins, totals = hubspot_api.alltime([all, sales, renewels], current_quarter_start, current_quarter_end, current_financial_year_start, current_financial_year_end, rate)
-    
-    # Loop through the margins and totals to write them to the Google Sheet
+    margins, totals = hubspot_api.alltime(sales, renewels, current_quarter_start, current_quarter_end, current_financial_year_start, current_financial_year_end, rate)
+
+    # Format every margin and total as a report string
+    reports = []
     for margin, total in zip(margins, totals):
-        excel_col = chr(65 + col)  # Convert column index to Excel column letter
         if margin != "NA":  # Check if margin is valid
-            report = f"{round(margin, 2)}% | deals: {total}"  # Format the report string
+            reports.append(f"{round(margin, 2)}% | deals: {total}")  # Format the report string
         else:
-            report = "NA"  # If no data, mark as NA
-        
-        worksheet.update_acell(f'{excel_col}{row}', report)  # Update the cell with the report
-        values_entered += 1  # Increment the values entered counter
-
-        # Change column after every 3 values entered
-        if values_entered % 3 == 0:
-            col += 1  # Move to the next column
-            row = 1  # Reset row for the new column
-        row += 1  # Move to the next row
+            reports.append("NA")  # If no data, mark as NA
+
+    # Build one range per column, changing column after every 3 values
+    column_updates = []
+    for start in range(0, len(reports), rows_per_col):
+        column_values = reports[start:start + rows_per_col]  # Values written down this column
+        excel_col = col + 1 + start // rows_per_col  # Sheet column number (B is 2)
+        start_cell = gspread.utils.rowcol_to_a1(row, excel_col)  # First cell of the column range
+        end_cell = gspread.utils.rowcol_to_a1(row + len(column_values) - 1, excel_col)  # Last cell of the column range
+        column_updates.append({"range": f"{start_cell}:{end_cell}", "values": [[value] for value in column_values]})
+
+    # Write every column range to the Google Sheet with one API call
+    worksheet = get_worksheet('<yourGoogleSheet>', 'CurrentMargin')  # Change 'CurrentMargin' to your actual sheet name if needed
+    retry_on_rate_limit(worksheet.batch_update)(column_updates, value_input_option='USER_ENTERED')
+
+def main():
+    """
+    Main function to execute the report generation process.
+    Fetches the exchange rate and writes the report to Google Sheets.
+    """
+    rate = get_nz_to_aud_rate()  # Fetch the NZD to AUD conversion rate
+    write_report(rate)
 
 if __name__ == "__main__":
     main()  # Execute the main function when the script is run
@@ -1,54 +1,27 @@
-import requests  # Library to make HTTP requests
 import gspread  # Library to interact with Google Sheets
-from oauth2client.service_account import ServiceAccountCredentials  # For Google Sheets authentication
-import json  # Library for handling JSON data
 from datetime import date  # To work with date objects
-import currencyapicom  # For fetching currency exchange rates
-
-# Load credentials from the JSON file for Google Sheets API access
-scope = [
-    'https://spreadsheets.google.com/feeds',  # Scope for Google Sheets API
-    'https://www.googleapis.com/auth/drive'    # Scope for Google Drive API
-]
-
-# Authenticate using the service account credentials
-credentials = ServiceAccountCredentials.from_json_keyfile_name('<serverkey json file>', scope)
-
-# Authorize and create a client to interact with the Google Sheets API
-gc = gspread.authorize(credentials)
-
-# Open the specified Google Spreadsheet by its URL
-sheet = gc.open_by_url('<googlesheetsBeingUsed>')
-
-# Select the specific worksheet by its name
-worksheet = sheet.worksheet('AllTime')  # Replace with the actual sheet name you want to use
-
-class HubSpotAPI:
-    def __init__(self):
-        # Initialize API access details for HubSpot
-        self.access_token = <insert your token>  # HubSpot API token
-        self.url = "https://api.hubspot.com/crm/v3/objects/deals/search"  # URL for HubSpot deals API
-        self.headers = {
-            "Authorization": f"Bearer {self.access_token}",  # Set authorization header
-            "Content-Type": "application/json"  # Specify content type as JSON
-        }
-        
-    def find_deals(self, page, length):
+from HubSpotCommon import HubSpotClient, get_nz_to_aud_rate, get_worksheet, retry_on_rate_limit  # Shared HubSpot and Google Sheets helpers
+
+class HubSpotAPI(HubSpotClient):
+    amount_property = "amount_in_home_currency"  # Deal property holding the deal amount in AUD
+
+    def find_deals(self, after=None):
         """
-        Fetch deals from HubSpot based on pagination and filters.
+        Fetch one page of deals from HubSpot based on filters.
 
         Args:
-            page (str): The pagination type (e.g., "limit" or "after").
-            length (int): The length or offset for pagination.
+            after (str): Paging cursor returned by the previous page, or None for the first page.
 
         Returns:
-            list: A list of deals retrieved from HubSpot.
+            tuple: A list of deals retrieved from HubSpot and the cursor for the next page (None if this is the last page).
+
+        Raises:
+            HubSpotError: If the page cannot be fetched. A failed page aborts the run instead of ending pagination early.
         """
         # Prepare the request data for fetching deals
         data = {
             "limit": 100,  # Limit the number of results to 100
-            page: length,  # Use the provided page parameter
-            "properties": ["net_revenue", "amount_in_home_currency", "dealstage", "deal_currency_code"],
+            "properties": ["net_revenue", "amount_in_home_currency", "deal_currency_code"],  # Only the properties used in the report
             "filterGroups": [
                 {
                     "filters": [
@@ -62,105 +35,41 @@ class HubSpotAPI:
                 }
             ]
         }
+        return self.search(data, after)  # Fetch the page of deals
 
-        # Make a POST request to the HubSpot API to fetch deals
-        response = requests.post(self.url, headers=self.headers, json=data)
-        if response.status_code == 200:
-            # If successful, return the list of deals from the response
-            return response.json().get('results', [])
-        else:
-            # Print error details if the request fails
-            print("Request failed:", response.status_code, response.text)
-            return []
-        
-    def get_nz_to_aud_rate(self):
+    def extract_data(self, pages, rate):
         """
-        Fetch the latest NZD to AUD exchange rate.
+        Extract and aggregate financial metrics from pages of deals as they are fetched.
 
-        Returns:
-            float: The conversion rate from NZD to AUD, or None if an error occurs.
-        """
-        # Initialize the currency client to fetch exchange rates
-        client = currencyapicom.Client('<api for currentapi.com>')
-        try:
-            # Fetch the latest exchange rate for NZD to AUD
-            result = client.latest('AUD', currencies=['NZD'])
-            amount = result['data']['NZD']['value']  # Get the exchange rate value
-            amount = float(amount)  # Convert the rate to a float
-            return amount  # Return the exchange rate
-        except Exception as e:
-            # Print error message if fetching the exchange rate fails
-            print(f"Error fetching exchange rate: {e}")
-            return None
-    
-    def extract_data(self, deals, rate):
-        """
-        Extract and aggregate financial metrics from the fetched deals.
+        Only running totals are kept, so a page can be discarded once it has been added.
 
         Args:
-            deals (list): The list of deals retrieved from HubSpot.
+            pages (iterable): Pages of deals retrieved from HubSpot.
             rate (float): The exchange rate from NZD to AUD.
 
         Returns:
             tuple: Calculated metrics including margin, deal count, total amount, net revenue, and cost.
         """
-        # Initialize variables for aggregating data
-        idcal = []  # List to store deal IDs
+        # Initialize running totals for aggregating data
         num_amounts = 0  # Total amounts counter
         num_net_revenue = 0  # Total net revenue counter
-        
-        # Loop through each deal to extract relevant information
-        for deal in deals:
-            amount = deal['properties'].get('amount_in_home_currency')  # Get the deal amount
-            id = deal['properties'].get('hs_object_id')  # Get the deal ID
-            net_revenue = deal['properties'].get('net_revenue')  # Get the net revenue
-            currency = deal['properties'].get('deal_currency_code')  # Get the currency type
-            idcal.append(id)  # Store the deal ID for reference
-
-            # If the currency is NZD, convert the net revenue to AUD
-            if currency == "NZD":
-                if rate is not None:  # Ensure the exchange rate was successfully fetched
-                    net_revenue_aud = float(net_revenue) / rate  # Convert net revenue to AUD
-                    net_revenue = net_revenue_aud  # Update the net revenue to AUD
-
-            num_amounts += float(amount)  # Aggregate the total amounts
-            if net_revenue:
-                num_net_revenue += float(net_revenue)  # Aggregate net revenue if available
-            else:
-                num_net_revenue += float(amount)  # Use amount if net revenue is not available
-
-            # Calculate margin and cost
-            margin = ((num_net_revenue / num_amounts) * 100)  # Calculate profit margin
-            cost = num_amounts - num_net_revenue  # Calculate cost
+        dealcount = 0  # Deal counter
 
-        # Return calculated metrics as a tuple
-        return margin, len(idcal), num_amounts, num_net_revenue, cost
+        # Add each page to the running totals
+        for deals in pages:
+            page_amounts, page_net_revenue, page_count = self.aggregate_deals(deals, rate)
+            num_amounts += page_amounts
+            num_net_revenue += page_net_revenue
+            dealcount += page_count
 
-    def increment_file_number(self):
-        """
-        Increment a number stored in a text file and return the previous number.
+        # Calculate margin and cost
+        margin = ((num_net_revenue / num_amounts) * 100) if num_amounts else 0.0  # Calculate profit margin
+        cost = num_amounts - num_net_revenue  # Calculate cost
 
-        Returns:
-            int: The previous number before incrementing.
-        """
-        filename = "rownumber.txt"  # Name of the file storing the row number
-        try:
-            # Open the file in read mode to get the current number
-            with open(filename, "r") as file:
-                number_str = file.read()  # Read the number as a string
-                number = int(number_str)  # Convert the string to an integer
-
-            previousnumber = number  # Store the previous number before incrementing
-            number += 1  # Increment the number by 1
-
-            # Open the file again in write mode to save the incremented number
-            with open(filename, "w") as file:
-                file.write(str(number))  # Write the new number back to the file
-                return previousnumber  # Return the previous number
-        except IOError as e:
-            # Raise an error if there was an issue accessing the file
-            raise IOError(f"An error occurred while accessing the file: {e}") from e
-  
+        # Return calculated metrics as a tuple
+        return margin, dealcount, num_amounts, num_net_revenue, cost
+
+    @retry_on_rate_limit
     def get_next_open_row(self, worksheet):
         """
         Find the next available row in the specified worksheet.
@@ -171,16 +80,16 @@ class HubSpotAPI:
         Returns:
             int: The next available row number, or None if no rows are available.
         """
-        currentrow = self.increment_file_number()  # Get the current row from the file
-        print("Current row:", currentrow)
+        # Fetch the whole first column in one API call, the next row is the one after the last filled cell
+        column = worksheet.col_values(1)  # Values of column A (trailing empty cells are omitted)
+        row = len(column) + 1
 
-        # Check for the next empty row starting from currentrow
-        for row in range(currentrow, worksheet.row_count + 1):  
-            if worksheet.cell(row=row, col=1).value is None:  # Check if the first cell in the row is empty
-                print("Next available row:", row)  # Print the found empty row
-                return row  # Return the found empty row number
-        return None  # Return None if no empty rows are found
+        if row > worksheet.row_count:
+            return None  # Return None if no empty rows are found
+        print("Next available row:", row)  # Print the found empty row
+        return row  # Return the found empty row number
 
+    @retry_on_rate_limit
     def write_data_to_sheet(self, data, row, worksheet):
         """
         Write a list of data to the specified row in the Google Sheet.
@@ -190,16 +99,22 @@ class HubSpotAPI:
             row (int): The row number where data should be written.
             worksheet: The Google Sheets worksheet object.
         """
-        col = 0  # Initialize column index
-        for value in data:
-            excel_col = chr(65 + col)  # Convert column index to letter (A=0, B=1, ...)
-            worksheet.update_acell(f'{excel_col}{row}', value)  # Update the cell with the value
-            col += 1  # Increment column index for the next value
+        start_cell = gspread.utils.rowcol_to_a1(row, 1)  # First cell of the row (column A)
+        end_cell = gspread.utils.rowcol_to_a1(row, len(data))  # Last cell covered by the data
+        range_name = gspread.utils.absolute_range_name(worksheet.title, f"{start_cell}:{end_cell}")  # e.g. 'AllTime'!A5:F5
 
-def main():
+        # Write the whole row in a single values.batchUpdate call
+        worksheet.spreadsheet.values_batch_update({
+            "valueInputOption": "USER_ENTERED",  # Let Sheets parse dates and percentages as it does for typed input
+            "data": [{"range": range_name, "values": [data]}]
+        })
+
+def write_report(rate):
     """
-    Main function to execute the report generation process.
-    It fetches deals, processes data, and writes results to Google Sheets.
+    Fetch deals from HubSpot, process the data, and write the results to Google Sheets.
+
+    Args:
+        rate (float): The exchange rate from NZD to AUD, or None if it could not be fetched.
     """
     today = date.today()  # Get today's date for reporting
     today = str(today)  # Convert date to string format
@@ -207,20 +122,8 @@ def main():
     # Initialize the HubSpot API client
     hubspot_api = HubSpotAPI()
     
-    # Fetch the NZD to AUD conversion rate
-    rate = hubspot_api.get_nz_to_aud_rate()
-    
-    # Retrieve deals from HubSpot API
-    answer = hubspot_api.find_deals("limit", 100)
-    length = len(answer)  # Get the length of the initial response
-
-    # Continue fetching deals if the last batch had 100 deals (indicating more available)
-    while length % 100 == 0:
-        answer += hubspot_api.find_deals("after", length)  # Fetch additional deals
-        length = len(answer)  # Update length after fetching
-
-    # Extract aggregated financial data from the deals
-    margin, dealcount, amount, netRevenue, cost = hubspot_api.extract_data(answer, rate)
+    # Stream every page of deals from HubSpot API into the aggregated financial data
+    margin, dealcount, amount, netRevenue, cost = hubspot_api.extract_data(hubspot_api.iter_deal_pages(), rate)
     
     # Round calculated values for more readable reporting
     margin = round(margin, 2)  # Round margin to 2 decimal places
@@ -229,6 +132,8 @@ def main():
     netRevenue = round(netRevenue, 2)  # Round net revenue
     cost = round(cost, 2)  # Round cost
 
+    worksheet = get_worksheet('<googlesheetsBeingUsed>', 'AllTime')  # Replace with the actual sheet name you want to use
+
     # Find the next open row in the worksheet to write data
     next_row = hubspot_api.get_next_open_row(worksheet)
     if next_row is None:
@@ -244,5 +149,13 @@ def main():
     # Confirm that the report was written successfully
     print(f"Daily report for {today} written to your_workbook")
 
+def main():
+    """
+    Main function to execute the report generation process.
+    It fetches the exchange rate and writes the daily report to Google Sheets.
+    """
+    rate = get_nz_to_aud_rate()  # Fetch the NZD to AUD conversion rate
+    write_report(rate)
+
 if __name__ == "__main__":
     main()  # Execute the main function when the script is run
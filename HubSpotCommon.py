@@ -0,0 +1,294 @@
+import functools  # For caching the shared clients
+import random  # For adding jitter to retry delays
+import threading  # For limiting concurrent HubSpot requests
+import time  # For waiting between retries
+import requests  # Library for making HTTP requests
+import gspread  # Library for interacting with Google Sheets
+from requests.adapters import HTTPAdapter  # For configuring retries on the HubSpot session
+from urllib3.util.retry import Retry  # Retry policy with exponential backoff
+from oauth2client.service_account import ServiceAccountCredentials  # For Google Sheets API authentication
+import json  # Library for handling JSON data
+from datetime import datetime, timedelta  # For checking the age of the cached exchange rate
+import currencyapicom  # For fetching currency exchange rates
+import orjson  # Fast JSON encoding and decoding for HubSpot requests
+from concurrent.futures import ThreadPoolExecutor  # For fetching the next page of deals in the background
+
+# Scopes for Google Sheets API access
+scope = [
+    'https://spreadsheets.google.com/feeds',  # Scope for Google Sheets API
+    'https://www.googleapis.com/auth/drive'    # Scope for Google Drive API
+]
+
+# Cap concurrent HubSpot requests across every client in the process to stay under the search rate limit
+request_slots = threading.BoundedSemaphore(5)
+
+class HubSpotError(Exception):
+    """
+    Raised when a HubSpot request still fails after retries, so no report is written from incomplete data.
+    """
+
+def retry_on_rate_limit(func):
+    """
+    Retry a Google Sheets call with exponential backoff when the API returns 429 Too Many Requests.
+
+    Args:
+        func (callable): The function making the Google Sheets API call.
+
+    Returns:
+        callable: The wrapped function.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(5):
+            try:
+                return func(*args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                if e.response.status_code != 429:
+                    raise  # Only rate limit errors are worth retrying
+                delay = 2 ** attempt + random.random()  # Exponential backoff with jitter
+                print(f"Google Sheets rate limit hit, retrying in {delay:.1f} seconds")
+                time.sleep(delay)
+        return func(*args, **kwargs)  # Last attempt, any error is raised to the caller
+    return wrapper
+
+@functools.lru_cache(maxsize=1)
+def get_credentials():
+    """
+    Load the service account credentials for Google Sheets API access.
+
+    The credentials are loaded once and reused for the lifetime of the process.
+
+    Returns:
+        ServiceAccountCredentials: The loaded service account credentials.
+    """
+    return ServiceAccountCredentials.from_json_keyfile_name('<serverkey json file>', scope)
+
+@functools.lru_cache(maxsize=1)
+@retry_on_rate_limit
+def get_sheets_client():
+    """
+    Authenticate with Google Sheets once and share the client between reports.
+
+    Returns:
+        gspread.Client: The authorized Google Sheets client.
+    """
+    return gspread.authorize(get_credentials())
+
+@functools.lru_cache(maxsize=None)
+@retry_on_rate_limit
+def get_worksheet(url, name):
+    """
+    Open a worksheet by spreadsheet URL and worksheet name.
+
+    Each worksheet handle is cached so repeated runs in the same process skip the lookup.
+
+    Args:
+        url (str): The URL of the Google Spreadsheet.
+        name (str): The name of the worksheet.
+
+    Returns:
+        gspread.Worksheet: The requested worksheet.
+    """
+    sheet = get_sheets_client().open_by_url(url)  # Open the specified Google Spreadsheet by its URL
+    return sheet.worksheet(name)  # Select the worksheet by its name
+
+@functools.lru_cache(maxsize=1)
+def get_session():
+    """
+    Create the HubSpot session shared by every report in the process.
+
+    Returns:
+        requests.Session: A session with the HubSpot headers and retry policy configured.
+    """
+    access_token = "<your API Token>"  # HubSpot API token
+    session = requests.Session()  # Reuse one connection to HubSpot across requests
+    session.headers.update({
+        "Authorization": f"Bearer {access_token}",  # Set the authorization header
+        "Content-Type": "application/json"  # Specify content type as JSON
+    })
+
+    # Retry rate limited and failed requests with exponential backoff, honouring Retry-After
+    retry = Retry(
+        total=5,
+        backoff_factor=1.0,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["POST", "GET", "PUT"],
+        respect_retry_after_header=True,
+        raise_on_status=False  # Return the last response so the search can report the failure and raise HubSpotError
+    )
+    session.mount("https://", HTTPAdapter(max_retries=retry))
+    return session
+
+def get_nz_to_aud_rate():
+    """
+    Fetch the latest NZD to AUD exchange rate.
+
+    The rate is cached in a local JSON file for 24 hours. If the currency API
+    cannot be reached, the last cached rate is used instead.
+
+    Returns:
+        float: The conversion rate from NZD to AUD, or None if an error occurs and no cached rate exists.
+    """
+    cache_file = "fx_cache.json"  # Name of the file storing the last fetched rate
+    cached = None  # Last cached rate entry, if any
+    try:
+        # Read the cached rate and the time it was fetched
+        with open(cache_file, "r") as file:
+            cached = json.load(file)
+        fetched = datetime.fromisoformat(cached["fetched"])  # When the cached rate was fetched
+        if datetime.now() - fetched < timedelta(hours=24):
+            return float(cached["rate"])  # Use the cached rate while it is less than a day old
+    except (IOError, ValueError, KeyError, TypeError):
+        cached = None  # Ignore a missing or unreadable cache file
+
+    client = currencyapicom.Client('<currency API>')  # Initialize the currency client
+    try:
+        # Fetch the latest exchange rate for NZD to AUD
+        result = client.latest('AUD', currencies=['NZD'])
+        amount = result['data']['NZD']['value']  # Get the exchange rate value
+        amount = float(amount)  # Convert the rate to a float
+    except Exception as e:
+        # Print error message if fetching the exchange rate fails
+        print(f"Error fetching exchange rate: {e}")
+        if cached is not None:
+            print("Using cached exchange rate from", cached["fetched"])
+            return float(cached["rate"])  # Fall back to the stale cached rate
+        return None
+
+    # Only cache rates that were fetched successfully
+    try:
+        with open(cache_file, "w") as file:
+            json.dump({"rate": amount, "fetched": datetime.now().isoformat()}, file)
+    except IOError as e:
+        print(f"Error writing exchange rate cache: {e}")
+
+    return amount  # Return the exchange rate
+
+class HubSpotClient:
+    """
+    Shared HubSpot deal search client. Reports subclass it, implement find_deals and set
+    amount_property to the deal property holding the deal amount.
+    """
+
+    def __init__(self):
+        # Initialize API access details for HubSpot
+        self.url = "https://api.hubspot.com/crm/v3/objects/deals/search"  # URL for HubSpot deals API
+        self.session = get_session()  # Shared session, so every report reuses the same connection
+
+    def search(self, data, after=None):
+        """
+        Run one HubSpot deal search request.
+
+        Args:
+            data (dict): The search request body.
+            after (str): Paging cursor returned by the previous page, or None for the first page.
+
+        Returns:
+            tuple: A list of deals retrieved from HubSpot and the cursor for the next page (None if this is the last page).
+
+        Raises:
+            HubSpotError: If the request still fails after retries.
+        """
+        if after is not None:
+            data = dict(data, after=after)  # Continue from the cursor of the previous page
+
+        # Make a POST request to the HubSpot API to fetch deals
+        with request_slots:  # Wait for a free request slot
+            response = self.session.post(self.url, data=orjson.dumps(data))  # Content-Type is set on the session headers
+        if response.status_code == 200:
+            # If successful, return the list of deals and the cursor for the next page
+            body = orjson.loads(response.content)
+            next_after = body.get('paging', {}).get('next', {}).get('after')
+            return self.coerce_deals(body.get('results', [])), next_after
+        else:
+            # Print error details and stop the run, a missing page would make the report figures too low
+            print("Request failed:", response.status_code, response.text)
+            raise HubSpotError(f"HubSpot deal search failed with status {response.status_code}")
+
+    def coerce_deals(self, deals):
+        """
+        Convert the numeric properties of each deal from strings to floats in a single sweep.
+
+        Args:
+            deals (list): The list of deals retrieved from HubSpot.
+
+        Returns:
+            list: The same deals, with the amount as a float and net revenue as a float or None if not set.
+        """
+        amount_property = self.amount_property  # Local lookup for the loop below
+        for deal in deals:
+            properties = deal['properties']
+            properties[amount_property] = float(properties.get(amount_property))  # Deal amount
+            net_revenue = properties.get('net_revenue')
+            properties['net_revenue'] = float(net_revenue) if net_revenue else None  # Net revenue, if available
+        return deals
+
+    def iter_deal_pages(self, *filters):
+        """
+        Yield pages of deals from HubSpot, fetching the next page while the current one is processed.
+
+        Args:
+            *filters: Arguments passed to find_deals ahead of the paging cursor.
+
+        Yields:
+            list: One page of deals retrieved from HubSpot.
+
+        Raises:
+            HubSpotError: If any page cannot be fetched, including a page prefetched in the background.
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            deals, next_after = self.find_deals(*filters)  # Fetch the first page of deals
+
+            # Keep following the paging cursor until HubSpot reports no further pages
+            while next_after:
+                # Start fetching the next page before handing back the current one
+                next_page = executor.submit(self.find_deals, *filters, next_after)
+                yield deals
+                deals, next_after = next_page.result()
+
+            yield deals  # Last page
+
+    def net_revenue_in_aud(self, properties, amount, rate):
+        """
+        Get the net revenue of a single deal in AUD.
+
+        Args:
+            properties (dict): The coerced properties of the deal retrieved from HubSpot.
+            amount (float): The deal amount, used when net revenue is not available.
+            rate (float): The exchange rate from NZD to AUD.
+
+        Returns:
+            float: The net revenue of the deal in AUD.
+        """
+        net_revenue = properties['net_revenue']  # Get the net revenue
+        if net_revenue is None:
+            return amount  # Use the amount if net revenue is not available
+
+        # If the currency is NZD, convert the net revenue to AUD
+        if properties.get('deal_currency_code') == "NZD" and rate is not None:  # Ensure the exchange rate was successfully fetched
+            net_revenue = net_revenue / rate
+            if not net_revenue:
+                return amount  # A converted net revenue of zero falls back to the amount, as before
+        return net_revenue
+
+    def aggregate_deals(self, deals, rate):
+        """
+        Sum the amounts and net revenue of the fetched deals.
+
+        Args:
+            deals (list): The list of deals retrieved from HubSpot, already coerced by coerce_deals.
+            rate (float): The exchange rate from NZD to AUD.
+
+        Returns:
+            tuple: Total amount, total net revenue and number of deals.
+        """
+        # Pull the properties out of every deal once
+        properties = [deal['properties'] for deal in deals]
+
+        # Gather each field into a column of floats, then aggregate with sum()
+        amounts = [prop[self.amount_property] for prop in properties]  # Deal amounts
+        net_revenues = [self.net_revenue_in_aud(prop, amount, rate) for prop, amount in zip(properties, amounts)]  # Net revenue in AUD
+        num_amounts = sum(amounts)  # Total amounts
+        num_net_revenue = sum(net_revenues)  # Total net revenue
+
+        return num_amounts, num_net_revenue, len(properties)  # Return the sums so they can be combined across deal stages
@@ -0,0 +1,16 @@
+import FinancialYearMargin  # Current quarter and financial year margin report
+import FutureMargin  # Daily future margin report
+from HubSpotCommon import get_nz_to_aud_rate  # Shared exchange rate lookup
+
+def main():
+    """
+    Run both reports back to back in one process.
+    The HubSpot session, Google Sheets client and exchange rate are set up once and shared by both reports.
+    """
+    rate = get_nz_to_aud_rate()  # Fetch the NZD to AUD conversion rate once for both reports
+
+    FinancialYearMargin.write_report(rate)  # Write the current margin report
+    FutureMargin.write_report(rate)  # Append the daily future margin report
+
+if __name__ == "__main__":
+    main()  # Execute the main function when the script is run